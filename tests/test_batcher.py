@@ -1,10 +1,11 @@
 import numpy as np
+import torch
 from pypaq.lipytools.files import prep_folder, w_pickle, list_dir, r_pickle
 import unittest
 
 from tests.envy import flush_tmp_dir
 
-from torchness.batcher import DataBatcher, FilesBatcher, FilesBatcherMP, BATCHING_TYPES
+from torchness.batcher import DataBatcher, BucketBatcher, FilesBatcher, FilesBatcherMP, CUDAPrefetchBatcher, BATCHING_TYPES
 from pypaq.lipytools.stats import msmx
 
 BATCHER_DATA_DIR = f'{flush_tmp_dir()}/batcher/datafiles'
@@ -65,21 +66,153 @@ class TestDataBatcher(unittest.TestCase):
 
             batcher = DataBatcher(data_TR=data, batch_size=batch_size, batching_type=btype)
 
-            sL = []
+            sL = np.empty(num_batches*batch_size, dtype=samples.dtype)
+            pos = 0
+            covered = np.zeros(num_samples, dtype=bool)
             n_b = 0
-            s_counter = {s: 0 for s in range(num_samples)}
+            s_counter = np.zeros(num_samples, dtype=np.int64)
             for _ in range(num_batches):
-                sL += batcher.get_batch()['samples'].tolist()
+                batch = batcher.get_batch()['samples']
+                sL[pos:pos+len(batch)] = batch
+                pos += len(batch)
+                covered[batch] = True
                 n_b += 1
-                if len(set(sL)) == num_samples:
+                if covered.all():
                     print(f'got full coverage with {n_b} batches')
-                    for s in sL: s_counter[s] += 1
-                    sL = []
+                    s_counter += np.bincount(sL[:pos], minlength=num_samples)
+                    pos = 0
+                    covered[:] = False
                     n_b = 0
 
-            print(msmx(list(s_counter.values()))['string'])
+            print(msmx(s_counter.tolist())['string'])
         print(f' *** finished coverage tests')
 
+    # leftover samples of a chunk are merged with the next one, for both np.ndarray and torch.Tensor
+    def test_left_merge(self):
+        for btype in BATCHING_TYPES:
+            for samples in [np.arange(1000), torch.arange(1000)]:
+                batcher = DataBatcher(data_TR={'samples':samples}, batch_size=64, batching_type=btype)
+                sL = [batcher.get_batch()['samples'] for _ in range(1000)]
+                sL = np.concatenate([np.asarray(s) for s in sL])
+                counts = np.bincount(sL, minlength=1000)
+                print(btype, type(samples).__name__, counts.min(), counts.max())
+                self.assertTrue(counts.max() - counts.min() <= 1)
+
+    # batches of Batcher with grouped keys are equal to not grouped
+    def test_group_keys(self):
+        data = {
+            'a': np.random.rand(1000,3,4),
+            'b': np.random.rand(1000),
+            'c': np.arange(1000),
+            'd': np.arange(1000) * 2,
+            'e': torch.rand(1000,2)}
+        batcher = DataBatcher(data_TR=data, batch_size=64)
+        batcher_grouped = DataBatcher(data_TR=data, batch_size=64, group_keys=True)
+        for _ in range(100):
+            batch = batcher.get_batch()
+            batch_grouped = batcher_grouped.get_batch()
+            for k in batch:
+                self.assertTrue(np.array_equal(np.asarray(batch[k]), np.asarray(batch_grouped[k])))
+        # source data is not kept besides the grouped copy
+        for k in 'abcd':
+            self.assertTrue(any(np.shares_memory(batcher_grouped._data_TR_chunk[k], g) for g,_ in batcher_grouped._groups))
+        self.assertTrue(batcher_grouped._data_TR_chunk is not data)
+
+    # BucketBatcher covers all samples and gives batches of similar length samples
+    def test_bucket(self):
+        lengths = np.random.randint(1, 200, 5000)
+        data = {'samples':np.arange(5000), 'lengths':lengths}
+        batcher = DataBatcher(data_TR=data, batch_size=32)
+        batcher_bucket = BucketBatcher(data_TR=data, batch_size=32, length_key='lengths')
+        s_counter = np.zeros(5000, dtype=np.int64)
+        n_epoch_batches = 5000 // 32
+        for epoch in range(6):
+            pad = 0
+            pad_bucket = 0
+            spread = 0
+            for _ in range(n_epoch_batches):
+                batch = batcher.get_batch()
+                batch_bucket = batcher_bucket.get_batch()
+                pad += (batch['lengths'].max() - batch['lengths']).sum()
+                pad_bucket += (batch_bucket['lengths'].max() - batch_bucket['lengths']).sum()
+                spread = max(spread, batch_bucket['lengths'].max() - batch_bucket['lengths'].min())
+                s_counter += np.bincount(batch_bucket['samples'], minlength=5000)
+            print(f'epoch {epoch} padding: {pad} -> {pad_bucket} ({pad_bucket/pad:.2f}), max spread: {spread}')
+            # every epoch (also with left samples of the previous one) is bucketed
+            self.assertTrue(pad_bucket < pad / 4)
+            # batch has samples of a single (or two neighbouring) bucket(s), buckets are ~20 wide
+            self.assertTrue(spread <= 50)
+        self.assertTrue(s_counter.min() >= 5)
+
+    # overridden load_data_TR_chunk() is called with every chunk (static chunk is not used)
+    def test_load_override(self):
+
+        class ResamplingBatcher(DataBatcher):
+            n_loads = 0
+            def load_data_TR_chunk(self):
+                self.n_loads += 1
+                return super().load_data_TR_chunk()
+
+        batcher = ResamplingBatcher(data_TR={'a': np.random.rand(100,3)}, batch_size=10)
+        for _ in range(50):
+            batcher.get_batch()
+        self.assertTrue(batcher.n_loads == 5)
+
+    # batches prepared by the prefetch thread are the same as without prefetch
+    def test_prefetch(self):
+        data = {
+            'a': np.random.rand(1000,3),
+            'b': torch.arange(1000)}
+        batcher = DataBatcher(data_TR=data, batch_size=64)
+        batcher_prefetch = DataBatcher(data_TR=data, batch_size=64)
+        batcher_prefetch.start_prefetch(n_ahead=3)
+        for _ in range(100):
+            batch = batcher.get_batch()
+            batch_prefetch = batcher_prefetch.get_batch()
+            for k in batch:
+                self.assertTrue(np.array_equal(np.asarray(batch[k]), np.asarray(batch_prefetch[k])))
+        # no batch is lost with close() and the next start_prefetch()
+        batcher_prefetch.close()
+        for ix in range(100):
+            if ix == 50:
+                batcher_prefetch.start_prefetch(n_ahead=3)
+            if ix == 51:
+                batcher_prefetch.close()
+            batch = batcher.get_batch()
+            batch_prefetch = batcher_prefetch.get_batch()
+            for k in batch:
+                self.assertTrue(np.array_equal(np.asarray(batch[k]), np.asarray(batch_prefetch[k])))
+
+    # exception of the prefetch thread is raised with every next get_batch(), until close()
+    def test_prefetch_exception(self):
+        batcher = DataBatcher(data_TR={'a': np.random.rand(1000,3)}, batch_size=64)
+        next_batch = batcher._next_batch
+        def failing_next_batch():
+            raise ValueError('load failed')
+        batcher._next_batch = failing_next_batch
+        batcher.start_prefetch()
+        for _ in range(3):
+            self.assertRaises(ValueError, batcher.get_batch)
+        batcher.close()
+        batcher._next_batch = next_batch
+        self.assertTrue(len(batcher.get_batch()['a']) == 64)
+
+    # after to_torch() batches are torch.Tensor, equal to np.ndarray batches
+    def test_to_torch(self):
+        data = {
+            'a': np.random.rand(1000,3),
+            'b': np.arange(1000)}
+        for btype in BATCHING_TYPES:
+            batcher = DataBatcher(data_TR=data, batch_size=64, batching_type=btype)
+            batcher_torch = DataBatcher(data_TR=data, batch_size=64, batching_type=btype, group_keys=True)
+            batcher_torch.to_torch()
+            for _ in range(100):
+                batch = batcher.get_batch()
+                batch_torch = batcher_torch.get_batch()
+                for k in batch:
+                    self.assertTrue(isinstance(batch_torch[k], torch.Tensor))
+                    self.assertTrue(np.array_equal(batch[k], batch_torch[k].numpy()))
+
     # test for Batcher reproducibility with seed
     def test_seed(self):
 
@@ -93,20 +226,21 @@ class TestDataBatcher(unittest.TestCase):
 
         batcher = DataBatcher(data, batch_size=b_size, batching_type='random')
         sA = []
-        while len(sA) < 10000:
-            sA += batcher.get_batch()['samples'].tolist()
-            np.random.seed(len(sA))
+        n_sA = 0
+        while n_sA < 10000:
+            sA.append(batcher.get_batch()['samples'])
+            n_sA += b_size
+            np.random.seed(n_sA)
 
         batcher = DataBatcher(data, batch_size=b_size, batching_type='random')
         sB = []
-        while len(sB) < 10000:
-            sB += batcher.get_batch()['samples'].tolist()
-            np.random.seed(10000000-len(sB))
+        n_sB = 0
+        while n_sB < 10000:
+            sB.append(batcher.get_batch()['samples'])
+            n_sB += b_size
+            np.random.seed(10000000-n_sB)
 
-        seed_is_fixed = True
-        for ix in range(len(sA)):
-            if sA[ix] != sB[ix]:
-                seed_is_fixed = False
+        seed_is_fixed = np.array_equal(np.concatenate(sA), np.concatenate(sB))
 
         print(f'seed is fixed: {seed_is_fixed}!')
         self.assertTrue(seed_is_fixed)
@@ -148,6 +282,50 @@ class TestFilesBatcher(unittest.TestCase):
 
         fb.exit()
 
+    # chunks are built once and then memory-mapped from cache_dir
+    def test_cache_dir(self):
+
+        n_files = 3
+        nf_samples = 1000
+
+        prep_folder(BATCHER_DATA_DIR, flush_non_empty=True)
+        for n in range(n_files):
+            data = {
+                'x':    np.random.rand(nf_samples,10),
+                'y':    torch.arange(nf_samples) + n*nf_samples}
+            w_pickle(data, f'{BATCHER_DATA_DIR}/f{n}.npp')
+
+        n_built = []
+        def chunk_builder(file:str):
+            n_built.append(file)
+            return r_pickle(file)
+
+        for _ in range(2):
+            fb = FilesBatcher(
+                data_files=     [f'{BATCHER_DATA_DIR}/{f}' for f in list_dir(BATCHER_DATA_DIR)['files']],
+                chunk_builder=  chunk_builder,
+                cache_dir=      f'{BATCHER_DATA_DIR}/cache',
+                batch_size=     100)
+            ys = []
+            for _ in range(n_files * nf_samples // 100 * 2):
+                ys.append(fb.get_batch()['y'])
+            fb.exit()
+            self.assertTrue(torch.equal(torch.cat(ys).bincount(), torch.full((n_files*nf_samples,), 2)))
+
+        self.assertTrue(len(n_built) == n_files)
+
+        # regenerated file is built again
+        w_pickle({'x': np.random.rand(10,10), 'y': torch.arange(10)}, f'{BATCHER_DATA_DIR}/f0.npp')
+        fb = FilesBatcher(
+            data_files=     [f'{BATCHER_DATA_DIR}/f0.npp'],
+            chunk_builder=  chunk_builder,
+            cache_dir=      f'{BATCHER_DATA_DIR}/cache',
+            batch_size=     5)
+        ys = torch.cat([fb.get_batch()['y'] for _ in range(2)])
+        fb.exit()
+        self.assertTrue(torch.equal(ys.sort().values, torch.arange(10)))
+        self.assertTrue(len(n_built) == n_files + 1)
+
 
 class TestFilesBatcherMP(unittest.TestCase):
 
@@ -184,4 +362,21 @@ class TestFilesBatcherMP(unittest.TestCase):
         print(len(ys))
         self.assertTrue(len(ys) == n_files * nf_samples * n_epochs)
 
-        fb.exit()
\ No newline at end of file
+        fb.exit()
+
+
+@unittest.skipUnless(torch.cuda.is_available(), 'CUDA not available')
+class TestCUDAPrefetchBatcher(unittest.TestCase):
+
+    def test_base(self):
+
+        data = {'samples': np.arange(1000)}
+        batcher = CUDAPrefetchBatcher(DataBatcher(data_TR=data, batch_size=64, batching_type='base'))
+
+        sL = []
+        for _ in range(10):
+            batch = batcher.get_batch()
+            self.assertTrue(batch['samples'].is_cuda)
+            sL.append(batch['samples'].cpu().numpy())
+        self.assertTrue(np.array_equal(np.concatenate(sL), np.arange(640)))
+        batcher.exit()
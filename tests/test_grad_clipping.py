@@ -71,4 +71,19 @@ class TestGradClipping(unittest.TestCase):
             print(f'{ix:02} {gres["gg_norm"]:.5f} {gres["gg_norm_clip"]:.5f} {vec.grad.norm():.5f}')
             if ix > 10: f = 4
             if ix > 50: f = 1
-            vec.grad = grad_1 * f
\ No newline at end of file
+            vec.grad = grad_1 * f
+
+    def test_invalidate_params(self):
+
+        module = torch.nn.Linear(10, 10)
+        gc = GradClipperMAVG(module=module, start_val=0.1)
+
+        module(torch.rand(4,10)).sum().backward()
+        gg_norm = gc.clip()['gg_norm']
+
+        # new parameter is not seen until params are invalidated
+        module.extra = torch.nn.Parameter(torch.rand(10))
+        module.extra.grad = torch.full((10,), 100.0)
+        self.assertTrue(gc.clip()['gg_norm'] < 2 * gg_norm)
+        gc.invalidate_params()
+        self.assertTrue(gc.clip()['gg_norm'] > 100)
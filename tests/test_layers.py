@@ -1,6 +1,7 @@
 import torch
 import unittest
 
+from torchness.base import TorchnessException
 from torchness.layers import LayDense, TF_Dropout, LayConv1D, PositionalEncoding, zeroes
 
 
@@ -73,6 +74,11 @@ class TestLayers(unittest.TestCase):
         print(out)
         print(out.shape)
 
+        pe = PositionalEncoding(64, max_len=16, dtype=torch.bfloat16)
+        out = pe(tns[:,:16].to(torch.bfloat16))
+        self.assertTrue(out.dtype == torch.bfloat16)
+        self.assertRaises(TorchnessException, pe, tns)
+
 
     def test_zeroes(self):
 
@@ -89,4 +95,10 @@ class TestLayers(unittest.TestCase):
         drl = TF_Dropout(time_drop=0.3, feat_drop=0.3)
         dropped = drl(tns)
         print(dropped)
-        print(zeroes(dropped))
\ No newline at end of file
+        print(zeroes(dropped))
+
+        # zeroes may be used with tensors that require grad
+        tns = torch.rand((3,4,5), requires_grad=True)
+        (tns * zeroes(tns)).sum().backward()
+        z = zeroes(tns)
+        z += 1
\ No newline at end of file
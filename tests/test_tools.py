@@ -1,7 +1,7 @@
 import torch
 import unittest
 
-from torchness.tools import select_with_indices
+from torchness.tools import select_with_indices, normalize_logits, perplexity, cross_entropy_loss
 
 
 class TestTools(unittest.TestCase):
@@ -21,7 +21,15 @@ class TestTools(unittest.TestCase):
 
         self.assertTrue(torch.equal(swi,_swi))
 
+    def test_perplexity(self):
 
+        logits = torch.rand(8,5) * 10
+        target = torch.randint(0,5,(8,))
 
+        logits_norm = normalize_logits(logits)
+        self.assertTrue(torch.allclose(logits_norm, torch.log(torch.softmax(logits, dim=-1)), atol=1e-5))
 
-
+        ppx = perplexity(logits, target)
+        ce = cross_entropy_loss(logits, target)
+        print(ppx, torch.exp(ce))
+        self.assertTrue(torch.allclose(ppx, torch.exp(ce)))
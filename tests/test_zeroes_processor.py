@@ -1,4 +1,4 @@
-import random
+import numpy as np
 import torch
 import unittest
 
@@ -10,17 +10,21 @@ from torchness.tbwr import TBwr
 
 BASE_DIR = f'{flush_tmp_dir()}/comoneural/zeroes'
 
-# returns tensor of 0 with randomly set N elements to 1
-def get_vector(
+rng = np.random.default_rng()
+
+# returns [num,width] tensor of 0 with (per row) randomly set N elements to 1
+def get_vectors(
+        num: int=        1,
         width: int=      10,
         n: int=          1,
         rand_one: float= 0.01
 ) -> TNS:
-    v = torch.zeros(width).to(int)
-    for _ in range(n):
-        if random.random() < rand_one:
-            v[random.randrange(width)] = 1
-    return v
+    v = np.zeros((num,width), dtype=int)
+    set_one = rng.random((num,n)) < rand_one
+    rows = np.repeat(np.arange(num), n).reshape(num,n)[set_one]
+    cols = rng.integers(0, width, size=(num,n))[set_one]
+    v[rows,cols] = 1
+    return torch.from_numpy(v)
 
 
 class TestZeroesProcessor(unittest.TestCase):
@@ -34,15 +38,31 @@ class TestZeroesProcessor(unittest.TestCase):
             intervals=  (10, 50, 100),
             tbwr=       TBwr(logdir=BASE_DIR))
 
-        for _ in range(10000):
+        n_iters = 10000
 
-            v = get_vector(width=10, n=2, rand_one=0.1)
+        vs = get_vectors(num=n_iters, width=10, n=2, rand_one=0.1)
 
-            # very often change fixed positions to 1
-            if random.random() < 0.95: v[0] = 1
-            if random.random() < 0.95: v[1] = 1
-            if random.random() < 0.95: v[2] = 1
+        # very often change fixed positions to 1
+        vs[:,:3][torch.from_numpy(rng.random((n_iters,3)) < 0.95)] = 1
 
+        for v in vs:
             nane = zepro.process(zeroes=v)
             if 100 in nane:
-                print(nane)
\ No newline at end of file
+                print(nane)
+
+    def test_more(self):
+
+        zepro = ZeroesProcessor(intervals=(10, 50, 100))
+
+        n_iters = 1000
+
+        # pool of vectors prepared before processing
+        vA = get_vectors(num=n_iters, width=10, rand_one=0.1)
+        vB = get_vectors(num=n_iters, width=20, rand_one=0.1)
+        vC = get_vectors(num=n_iters, width=33, rand_one=0.1)
+
+        for ix in range(n_iters):
+            nane = zepro.process(zeroes=[vA[ix], [vB[ix]], vC[ix]])
+            if 100 in nane:
+                print(nane)
+                self.assertTrue(0.0 <= float(nane[100]) <= 1.0)
\ No newline at end of file
@@ -1,12 +1,18 @@
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import numpy as np
+import logging
 from ompr.runner import OMPRunner, RunningWorker
+import os
 from pypaq.lipytools.pylogger import get_pylogger, get_child
 import queue
+import tempfile
 import threading
 import time
 import torch
-from typing import Dict, Optional, Tuple, List, Union, Any
+from typing import Dict, Optional, Tuple, List, Union, Any, Callable, Sequence
 
 from torchness.base import ARR, TNS, NPL
 
@@ -21,23 +27,97 @@ class BatcherException(Exception):
 
 
 # splits data into batches of given size
+# batches are slices (views) of data, no data is copied
 def split_into_batches(data:Dict[str,NPL], size:int) -> List[Dict[str,NPL]]:
-    split = []
-    counter = 0
     keys = list(data.keys())
-    while counter*size < len(data[keys[0]]):
-        split.append({k: data[k][counter*size:(counter+1)*size] for k in keys})
-        counter += 1
-    return split
+    return [{k: data[k][s:s+size] for k in keys} for s in range(0, len(data[keys[0]]), size)]
+
+
+def _concat_left(data_left:NPL, ixmap_left:ARR, data_new:NPL) -> NPL:
+    """ concatenates samples (indexed with ixmap_left) of data_left with data_new,
+    selected samples are written directly into a single preallocated output,
+    supports only ARR and TNS with the same dtype of both parts """
+
+    n_left = len(ixmap_left)
+
+    if isinstance(data_new, TNS):
+        out = torch.empty(
+            (n_left + data_new.shape[0],) + tuple(data_new.shape[1:]),
+            dtype=  data_new.dtype,
+            device= data_new.device)
+        torch.index_select(data_left, 0, torch.from_numpy(ixmap_left).to(data_left.device), out=out[:n_left])
+    else:
+        out = np.empty((n_left + data_new.shape[0],) + data_new.shape[1:], dtype=data_new.dtype)
+        np.take(data_left, ixmap_left, axis=0, out=out[:n_left])
+
+    out[n_left:] = data_new
+    return out
+
+
+def _group_by_dtype(arrays:Tuple[NPL,...]):
+    """ groups np.ndarray arrays of the same (numeric) dtype into single 2D arrays [N,feats],
+    columns of a group are concatenated flattened trailing dims of its arrays
+    returns:
+    - arrays replaced with views of groups (given arrays are not referenced,
+      those are freed if not referenced elsewhere, otherwise data is kept twice)
+    - groups: [(grouped_array, ((array_ix, columns_slice, batch_shape),..)),..]
+    - indexes of arrays left ungrouped (torch.Tensor, single array of a dtype, non-numeric dtype) """
+
+    by_dtype = {}
+    for ix,a in enumerate(arrays):
+        if isinstance(a, ARR) and a.dtype.kind in 'biufc':
+            by_dtype.setdefault(a.dtype, []).append(ix)
+
+    arrays = list(arrays)
+    groups = []
+    grouped_ixs = set()
+    for dtype, ixs in by_dtype.items():
+        if len(ixs) < 2:
+            continue
+        grouped = np.concatenate([arrays[ix].reshape(len(arrays[ix]), -1) for ix in ixs], axis=1)
+        members = []
+        col = 0
+        for ix in ixs:
+            shape = arrays[ix].shape
+            n_cols = int(np.prod(shape[1:]))
+            cols = slice(col, col+n_cols)
+            arrays[ix] = grouped[:,cols].reshape(shape)
+            members.append((ix, cols, (-1,) + shape[1:]))
+            col += n_cols
+        groups.append((grouped, tuple(members)))
+        grouped_ixs.update(ixs)
+
+    ungrouped = tuple(ix for ix in range(len(arrays)) if ix not in grouped_ixs)
+    return tuple(arrays), groups, ungrouped
+
+
+def _chunk_to_torch(chunk:Dict[str,NPL], pin_memory:bool=False) -> Dict[str,NPL]:
+    """ converts np.ndarray values of chunk to torch.Tensor (zero-copy for contiguous arrays),
+    optionally puts torch.Tensor values into pinned memory (copy) """
+    chunk_t = {}
+    for k,v in chunk.items():
+        if isinstance(v, ARR):
+            try:
+                v = torch.from_numpy(np.ascontiguousarray(v))
+            except TypeError: # dtype not supported by torch
+                pass
+        if pin_memory and isinstance(v, TNS) and not v.is_pinned():
+            v = v.pin_memory()
+        chunk_t[k] = v
+    return chunk_t
 
 
 class BaseBatcher(ABC):
     """ BaseBatcher prepares batches from chunks of training (TR) and testing (TS) data.
     It is an abstract class where load_data_TR_chunk() must be implemented.
     TS input data (unnamed chunk) is a dict: {axis_name: np.ndarray or torch.Tensor}.
-    TS data may be given also as a dict of named test-sets (chunks): {testset_name: {chunk}} """
+    TS data may be given also as a dict of named test-sets (chunks): {testset_name: {chunk}}
+    Single RNG (seeded once with seed) is used for the Batcher lifetime,
+    batches sequence is reproducible for a given seed and sequence of chunks.
+    For 'base' batching_type batches are views (slices) of TR data - not copies. """
 
     default_TS_name = '__TS__' # default name of testset when given as unnamed chunk
+    static_chunk = False # every chunk is the same data (same arrays)
 
     def __init__(
             self,
@@ -45,6 +125,8 @@ class BaseBatcher(ABC):
             batch_size: int=            16,
             batch_size_TS_mul: int=     2,      # VL & TS batch_size multiplier
             batching_type: str=         'random',
+            pin_memory: bool=           False,  # cache TS batches (torch.Tensor) in pinned memory
+            group_keys: bool=           False,  # group np.ndarray TR data of the same dtype, single gather per group, data is copied into groups
             seed=                       123,
             logger=                     None,
             loglevel=                   20,
@@ -54,8 +136,16 @@ class BaseBatcher(ABC):
             name=   f'{self.__class__.__name__}_logger',
             level=  loglevel)
 
-        self.seed_counter = seed
-        self.rng = np.random.default_rng(self.seed_counter)
+        self.rng = np.random.default_rng(seed)
+
+        if pin_memory and not torch.cuda.is_available():
+            self.logger.warning('pin_memory requires CUDA, it will be disabled')
+            pin_memory = False
+        self._pin_memory = pin_memory
+        self._group_keys = group_keys
+        # set with to_torch()
+        self._torch_TR = False
+        self._torch_TR_pin = False
 
         if batching_type not in BATCHING_TYPES:
             raise BatcherException('unknown batching_type')
@@ -63,16 +153,30 @@ class BaseBatcher(ABC):
         self.btype = batching_type
 
         self._batch_size = batch_size
-        self._batch_size_TS_mul = batch_size_TS_mul
+        self._batch_size_TS = batch_size * batch_size_TS_mul
 
         # properties below will be set when first chunk (and every next) will be loaded
         self._data_TR = {}
-        self._keys = []
+        self._keys: Tuple[str,...] = ()
+        self._arrays: Tuple[NPL,...] = () # data_TR values in order of keys, bound once per chunk
+        self._groups = None                 # set with group_keys, see _group_by_dtype()
+        self._devices: Tuple[Optional[torch.device],...] = () # device of each torch.Tensor array, None for others
+        self._ixmap_t: Dict[torch.device,TNS] = {}            # ixmap as torch.Tensor on each device of arrays
+        self._gather: Optional[Callable[[int,int],Dict[str,NPL]]] = None # set per chunk
+        self._ungrouped: Tuple[int,...] = ()
         self._data_TR_len = None
         self._ixmap = np.asarray([], dtype=int)
         self._ixmap_pointer = 0
+        self._ixmap_contiguous = False
         self._get_next_chunk_and_extend_ixmap()  # here first chunk is loaded
 
+        # set with start_prefetch()
+        self._prefetch_q: Optional[queue.Queue] = None
+        self._prefetch_stop: Optional[threading.Event] = None
+        self._prefetch_thread: Optional[threading.Thread] = None
+        self._prefetch_exc: Optional[Exception] = None # raised by the prefetch thread, kept until close()
+        self._prefetch_left = deque() # batches prepared by the prefetch thread but not given until close()
+
         if data_TS and type(list(data_TS.values())[0]) is not dict:
             data_TS = {self.default_TS_name: data_TS}
         self._data_TS: Dict[str,Dict[str,NPL]] = data_TS
@@ -84,9 +188,10 @@ class BaseBatcher(ABC):
         if self._data_TS and list(self._data_TS.keys()) != [self.default_TS_name]:
             self.logger.info(f' > data_TS names: {list(self._data_TS.keys())}')
         self.logger.info(f' > data_TS_len: {self._data_TS_len}')
-        self.logger.debug('> Batcher keys:')
-        for k in self._keys:
-            self.logger.debug(f'>> {k}, shape: {self._data_TR[k].shape}, type:{type(self._data_TR[k][0])}')
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('> Batcher keys:')
+            for k in self._keys:
+                self.logger.debug(f'>> {k}, shape: {self._data_TR[k].shape}, type:{type(self._data_TR[k][0])}')
 
     @abstractmethod
     def load_data_TR_chunk(self) -> Dict[str,NPL]:
@@ -98,67 +203,254 @@ class BaseBatcher(ABC):
         """ this method is called when Batcher has not enough TR data (self._data_TR),
         to be precise: when self._ixmap is small enough """
 
-        stime = time.time()
+        stime = time.time() if self.logger.isEnabledFor(logging.DEBUG) else None
+
+        # static chunk is already bound, left samples are indexes of the same arrays,
+        # only new ixmap is built, no data is loaded or copied
+        # ('base' still concatenates data, its batches are slices)
+        if self.static_chunk and self._arrays and not self._ixmap_contiguous:
+            self._ixmap = self._build_ixmap(
+                chunk=      self._data_TR,
+                n_left=     0,
+                dtype=      self._ixmap.dtype,
+                ixmap_left= self._ixmap[self._ixmap_pointer:])
+            self._ixmap_pointer = 0
+            ixmap_t = torch.from_numpy(self._ixmap)
+            self._ixmap_t = {d: ixmap_t.to(d) for d in self._ixmap_t}
+            if stime is not None:
+                self.logger.debug('> _get_next_chunk_and_extend_ixmap() took %.2fsec (static chunk)', time.time() - stime)
+            return
 
         chunk_next = self.load_data_TR_chunk()
+        if self._torch_TR:
+            chunk_next = _chunk_to_torch(chunk_next, pin_memory=self._torch_TR_pin)
 
         # set keys only once, with the first chunk
         if not self._keys:
-            self._keys = sorted(list(chunk_next.keys()))
-        chunk_next_len = chunk_next[self._keys[0]].shape[0]
-
-        _ixmap_new = None
-
-        if self.btype == 'base':
-            _ixmap_new = np.arange(chunk_next_len)
-
-        if self.btype == 'random':
-            _ixmap_new = self.rng.choice(
-                a=          chunk_next_len,
-                size=       chunk_next_len,
-                replace=    False)
+            self._keys = tuple(sorted(chunk_next))
 
         ### tries to concat left data with new chunk, only supported for ARR and TNS in chunks
 
-        _ixmap_left = self._ixmap[self._ixmap_pointer:]
-        _ixmap_left_size = len(_ixmap_left)
+        _ixmap_left_size = len(self._ixmap) - self._ixmap_pointer
+        n_left = 0
+
+        if _ixmap_left_size > 0:
 
-        if _ixmap_left_size:
+            _ixmap_left = self._ixmap[self._ixmap_pointer:]
 
+            # type of chunk is resolved once for all keys
             conc_func = None
-            if type(chunk_next[self._keys[0]]) is ARR:
+            if isinstance(chunk_next[self._keys[0]], ARR):
                 conc_func = np.concatenate
-            if type(chunk_next[self._keys[0]]) is TNS:
+            elif isinstance(chunk_next[self._keys[0]], TNS):
                 conc_func = torch.cat
 
             if conc_func:
                 for k in self._keys:
-                    chunk_next[k] = conc_func([self._data_TR[k][_ixmap_left], chunk_next[k]])
-                _ixmap_new = np.concatenate([np.arange(_ixmap_left_size), _ixmap_new+_ixmap_left_size])
+                    if self._data_TR[k].dtype == chunk_next[k].dtype:
+                        chunk_next[k] = _concat_left(self._data_TR[k], _ixmap_left, chunk_next[k])
+                    else:
+                        chunk_next[k] = conc_func([self._data_TR[k][_ixmap_left], chunk_next[k]])
+                n_left = _ixmap_left_size
             else:
                 self.logger.warning(f'Batcher was unable to use left {_ixmap_left_size} samples from chunk, try using np.ndarray or torch.Tensor with TR data')
 
-        self._ixmap = _ixmap_new
-        self._ixmap_pointer = 0
+        chunk_len = chunk_next[self._keys[0]].shape[0]
 
-        self._data_TR = chunk_next
+        # int32 indexes halve ixmap memory & bandwidth of gathers
+        ixmap_dtype = np.int32 if chunk_len < 2**31 else np.int64
+
+        self._ixmap = self._build_ixmap(chunk=chunk_next, n_left=n_left, dtype=ixmap_dtype)
+        self._ixmap_pointer = 0
+        # for 'base' ixmap is always np.arange(len(chunk)) (left samples are put at the beginning of chunk)
+        self._ixmap_contiguous = self.btype == 'base'
+
+        self._bind_chunk(chunk_next)
+
+        if stime is not None:
+            self.logger.debug('> _get_next_chunk_and_extend_ixmap() took %.2fsec', time.time() - stime)
+
+    def _bind_chunk(self, chunk:Dict[str,NPL]):
+        """ sets chunk as current TR data, prepares arrays and gather method for current ixmap """
+
+        self._data_TR = chunk
+        self._arrays = tuple(self._data_TR[k] for k in self._keys)
+        self._groups = None
+        self._ungrouped = ()
+        # grouping is useless for contiguous ixmap (batches are slices)
+        if self._group_keys and not self._ixmap_contiguous:
+            self._arrays, self._groups, self._ungrouped = _group_by_dtype(self._arrays)
+            self._data_TR = dict(zip(self._keys, self._arrays))
+
+        # torch.Tensor arrays are gathered with torch.index_select and (zero-copy) torch ixmap
+        self._devices = tuple(a.device if isinstance(a, TNS) else None for a in self._arrays)
+        ixmap_t = torch.from_numpy(self._ixmap)
+        self._ixmap_t = {d: ixmap_t.to(d) for d in set(self._devices) if d is not None}
         self._data_TR_len = self._data_TR[self._keys[0]].shape[0]
 
-        self.logger.debug(f'> _get_next_chunk_and_extend_ixmap() took {time.time() - stime:.2f}sec')
+        # gather method specialized for this chunk, get_batch does no more checks
+        if self._ixmap_contiguous:
+            self._gather = self._gather_slices
+        elif self._groups:
+            self._gather = self._gather_grouped
+        elif not self._ixmap_t:
+            self._gather = self._gather_np
+        else:
+            self._gather = self._gather_mixed
+
+    def to_torch(self, pin_memory:bool=False):
+        """ converts TR data (current and every next chunk) to torch.Tensor,
+        after that get_batch() returns torch.Tensor values (np.ndarray of dtype not supported by torch stay),
+        pin_memory: TR data is put in pinned memory, supported only for 'base' batching_type,
+        its batches are slices of pinned data and may be copied to device with non_blocking=True,
+        batches gathered for other batching types are new (pageable) tensors,
+        for those use start_prefetch(pin_memory=True) which pins every batch in the background,
+        group_keys grouping is dropped (only np.ndarray are grouped), grouped views are copied per key """
+
+        if pin_memory and not torch.cuda.is_available():
+            self.logger.warning('pin_memory requires CUDA, it will be disabled')
+            pin_memory = False
+
+        if pin_memory and self.btype != 'base':
+            self.logger.warning(f'pin_memory of TR data is useless for {self.btype} batching_type (batches are gathered copies), '
+                                'it will be disabled, use start_prefetch(pin_memory=True) instead')
+            pin_memory = False
+
+        self._torch_TR = True
+        self._torch_TR_pin = pin_memory
+        self._bind_chunk(self._current_chunk_to_torch(pin_memory=pin_memory))
+
+    def _current_chunk_to_torch(self, pin_memory:bool) -> Dict[str,NPL]:
+        return _chunk_to_torch(self._data_TR, pin_memory=pin_memory)
+
+    def _gather_slices(self, start:int, stop:int) -> Dict[str,NPL]:
+        """ contiguous indexes -> batch is a slice (view) of data, no gather (copy) needed """
+        return dict(zip(self._keys, [a[start:stop] for a in self._arrays]))
+
+    def _gather_np(self, start:int, stop:int) -> Dict[str,NPL]:
+        """ no torch.Tensor in data """
+        indexes = self._ixmap[start:stop]
+        return dict(zip(self._keys, [a[indexes] for a in self._arrays]))
+
+    def _gather_mixed(self, start:int, stop:int) -> Dict[str,NPL]:
+        indexes = self._ixmap[start:stop]
+        indexes_t = {d: ixt[start:stop] for d,ixt in self._ixmap_t.items()}
+        return dict(zip(self._keys, [
+            a[indexes] if d is None else torch.index_select(a, 0, indexes_t[d])
+            for a,d in zip(self._arrays, self._devices)]))
+
+    def _gather_grouped(self, start:int, stop:int) -> Dict[str,NPL]:
+        indexes = self._ixmap[start:stop]
+        indexes_t = {d: ixt[start:stop] for d,ixt in self._ixmap_t.items()}
+        batch = [None] * len(self._keys)
+        for grouped, members in self._groups:
+            gathered = grouped.take(indexes, axis=0)
+            for ix, cols, shape in members:
+                batch[ix] = gathered[:,cols].reshape(shape)
+        for ix in self._ungrouped:
+            a, d = self._arrays[ix], self._devices[ix]
+            batch[ix] = a[indexes] if d is None else torch.index_select(a, 0, indexes_t[d])
+        return dict(zip(self._keys, batch))
+
+    def _build_ixmap(
+            self,
+            chunk: Dict[str,NPL],
+            n_left: int,
+            dtype,
+            ixmap_left: Optional[ARR]=  None,
+    ) -> ARR:
+        """ returns ixmap (order of samples) for a chunk,
+        first n_left samples of chunk are left from the previous chunk, those are put first,
+        for a static chunk left samples are given as indexes (ixmap_left) of the same chunk, those are put first """
+
+        n_new = chunk[self._keys[0]].shape[0] - n_left
+        ixmap = np.arange(n_new, dtype=dtype)
 
-    def get_batch(self) -> Dict[str,NPL]:
+        if self.btype == 'random':
+            self.rng.shuffle(ixmap) # same as rng.permutation(n_new), but keeps dtype
+
+        if n_left:
+            ixmap = np.concatenate([np.arange(n_left, dtype=dtype), ixmap + n_left])
+
+        if ixmap_left is not None and len(ixmap_left):
+            ixmap = np.concatenate([ixmap_left, ixmap])
 
-        # set seed
-        self.rng = np.random.default_rng(self.seed_counter)
-        self.seed_counter += 1
+        return ixmap
+
+    def _next_batch(self) -> Dict[str,NPL]:
 
         if self._ixmap_pointer + self._batch_size > len(self._ixmap):
             self._get_next_chunk_and_extend_ixmap()
 
-        indexes = self._ixmap[self._ixmap_pointer:self._ixmap_pointer+self._batch_size]
+        start = self._ixmap_pointer
         self._ixmap_pointer += self._batch_size
+        return self._gather(start, self._ixmap_pointer)
+
+    def get_batch(self) -> Dict[str,NPL]:
 
-        return {k: self._data_TR[k][indexes] for k in self._keys}
+        if self._prefetch_q is None:
+            return self._prefetch_left.popleft() if self._prefetch_left else self._next_batch()
+
+        # the thread has exited after an exception, it is raised with every next call
+        if self._prefetch_exc is not None:
+            raise self._prefetch_exc
+
+        batch = self._prefetch_q.get()
+        if isinstance(batch, Exception): # raised by the prefetch thread
+            self._prefetch_exc = batch
+            raise batch
+        return batch
+
+    def start_prefetch(self, n_ahead:int=2, pin_memory:bool=False):
+        """ starts a background thread that prepares (gathers) next n_ahead TR batches,
+        while the current one is processed, get_batch() returns batches from the thread,
+        sequence of batches is the same as without prefetch,
+        pin_memory: batch values are returned as torch.Tensor in pinned memory """
+
+        if self._prefetch_thread is not None:
+            raise BatcherException('prefetch already started')
+
+        if pin_memory and not torch.cuda.is_available():
+            self.logger.warning('pin_memory requires CUDA, it will be disabled')
+            pin_memory = False
+
+        self._prefetch_q = queue.Queue(maxsize=n_ahead)
+        self._prefetch_stop = threading.Event()
+        self._prefetch_thread = threading.Thread(target=self._prefetch_loop, args=(pin_memory,), daemon=True)
+        self._prefetch_thread.start()
+
+    def _prefetch_loop(self, pin_memory:bool):
+        try:
+            while not self._prefetch_stop.is_set():
+                try:
+                    batch = self._prefetch_left.popleft() if self._prefetch_left else self._next_batch()
+                    if pin_memory:
+                        batch = _chunk_to_torch(batch, pin_memory=True)
+                except Exception as e:
+                    self._prefetch_q.put(e)
+                    break
+                self._prefetch_q.put(batch) # blocks while n_ahead batches are ready
+        finally:
+            self._prefetch_q.put(None) # marks end of the thread for close()
+
+    def close(self):
+        """ stops the prefetch thread (if started),
+        batches already prepared by the thread are not lost, those are given first by next get_batch() calls """
+        if self._prefetch_thread is None:
+            return
+        self._prefetch_stop.set()
+        # takes batches from the queue until the end of the thread, blocked put() of the thread returns
+        while True:
+            batch = self._prefetch_q.get()
+            if batch is None:
+                break
+            if not isinstance(batch, Exception):
+                self._prefetch_left.append(batch)
+        self._prefetch_thread.join()
+        self._prefetch_q = None
+        self._prefetch_stop = None
+        self._prefetch_thread = None
+        self._prefetch_exc = None
 
     def get_TS_batches(self, name:Optional[str]=None) -> List[Dict[str,NPL]]:
         """ if TS data was given as a dict of named test-sets then name (TS) has to be given,
@@ -169,13 +461,20 @@ class BaseBatcher(ABC):
                 raise BatcherException('ERR: TS name must be given!')
             name = self.default_TS_name
 
-        if name not in list(self._data_TS.keys()):
+        if name not in self._data_TS:
             raise BatcherException('ERR: TS name unknown!')
 
         if name not in self._TS_batches:
-            self._TS_batches[name] = split_into_batches(
+            batches = split_into_batches(
                 data=   self._data_TS[name],
-                size=   self._batch_size * self._batch_size_TS_mul)
+                size=   self._batch_size_TS)
+            # pinned once, allows faster (non_blocking) copies to device with every TS pass
+            if self._pin_memory:
+                for batch in batches:
+                    for k in batch:
+                        if isinstance(batch[k], TNS):
+                            batch[k] = batch[k].contiguous().pin_memory()
+            self._TS_batches[name] = batches
 
         return self._TS_batches[name]
 
@@ -193,7 +492,7 @@ class BaseBatcher(ABC):
 
     @property
     def keys(self) -> List[str]:
-        return self._keys
+        return list(self._keys)
 
 
 def data_split(
@@ -212,14 +511,13 @@ def data_split(
     splitB_len = int(d_len * split_factor)
     splitA_len = d_len - splitB_len
 
-    indicesA = indices[:splitA_len]
-    indicesB = indices[splitA_len:]
-
+    # single gather of permuted data per key, sets are slices (views) of it
     dataA = {}
     dataB = {}
     for k in keys:
-        dataA[k] = data[k][indicesA]
-        dataB[k] = data[k][indicesB]
+        permuted = data[k][indices]
+        dataA[k] = permuted[:splitA_len]
+        dataB[k] = permuted[splitA_len:]
 
     return dataA, dataB
 
@@ -230,6 +528,7 @@ class DataBatcher(BaseBatcher):
     TS data may be given as a named test-set: Dict[str, Dict[str,NPL]] """
 
     default_TS_name = '__TS__'
+    static_chunk = True
 
     def __init__(
             self,
@@ -249,89 +548,262 @@ class DataBatcher(BaseBatcher):
 
         self._data_TR_chunk = data_TR
 
+        # subclass overriding load_data_TR_chunk() (e.g. augmentation, resampling) gets a new chunk every time
+        self.static_chunk = type(self).load_data_TR_chunk is DataBatcher.load_data_TR_chunk
+
         super().__init__(seed=seed, **kwargs)
 
     def load_data_TR_chunk(self) -> Dict[str,NPL]:
         return {k:self._data_TR_chunk[k] for k in self._data_TR_chunk}
 
+    def _bind_chunk(self, chunk:Dict[str,NPL]):
+        super()._bind_chunk(chunk)
+        # static chunk is the source data, source is replaced with grouped views not to keep two copies of data
+        # (new dict, given data_TR is not modified)
+        if self.static_chunk and self._groups:
+            self._data_TR_chunk = dict(self._data_TR)
+
+    def _current_chunk_to_torch(self, pin_memory:bool) -> Dict[str,NPL]:
+        """ source data is converted (and pinned) once, not with every load,
+        static (not 'base') current chunk is the source data, it is bound from converted source (not copied again) """
+        self._data_TR_chunk = _chunk_to_torch(self._data_TR_chunk, pin_memory=pin_memory)
+        if not self._ixmap_contiguous:
+            return self.load_data_TR_chunk()
+        return super()._current_chunk_to_torch(pin_memory=pin_memory)
+
+
+class BucketBatcher(DataBatcher):
+    """ BucketBatcher prepares batches of samples of similar length,
+    it reduces padding of variable-length samples (e.g. sequences) done later by a consumer.
+    Length of samples is given with data_TR[length_key] (1-dim: int or float).
+    Samples are split into buckets by length and shuffled within them,
+    then batches are cut from buckets sorted by length and given in a random order,
+    so each batch contains samples of a single (or two neighbouring) bucket(s),
+    and all buckets are covered proportionally to their size (with every pass over data).
+    For length_key=None it works as a DataBatcher. """
+
+    def __init__(
+            self,
+            data_TR: Dict[str,NPL],
+            length_key: Optional[str]=                  None,
+            bucket_bounds: Optional[Sequence[float]]=   None,   # bounds of buckets, for None computed with num_buckets
+            num_buckets: int=                           10,     # number of (equally sized) buckets when bucket_bounds not given
+            **kwargs,
+    ):
+
+        if length_key is not None:
+
+            if length_key not in data_TR:
+                raise BatcherException(f'length_key: {length_key} not found in data_TR')
+
+            if kwargs.get('batching_type', 'random') != 'random':
+                raise BatcherException('BucketBatcher supports only random batching_type')
+
+        self._length_key = length_key
+        self._bucket_bounds = bucket_bounds
+        self._num_buckets = num_buckets
+
+        super().__init__(data_TR=data_TR, **kwargs)
+
+    def _build_ixmap(
+            self,
+            chunk: Dict[str,NPL],
+            n_left: int,
+            dtype,
+            ixmap_left: Optional[ARR]=  None,
+    ) -> ARR:
+        """ left samples (n_left of chunk or ixmap_left of static chunk) are bucketed together with the chunk """
+
+        if self._length_key is None:
+            return super()._build_ixmap(chunk=chunk, n_left=n_left, dtype=dtype, ixmap_left=ixmap_left)
+
+        # indexes of samples to order
+        samples = np.arange(chunk[self._length_key].shape[0], dtype=dtype)
+        if ixmap_left is not None and len(ixmap_left):
+            samples = np.concatenate([ixmap_left, samples])
+
+        lengths = np.asarray(chunk[self._length_key])[samples]
+        n = len(lengths)
+
+        bounds = self._bucket_bounds
+        if bounds is None:
+            bounds = np.quantile(lengths, np.linspace(0, 1, self._num_buckets + 1)[1:-1])
+        buckets = np.digitize(lengths, bounds)
+
+        # sorted by bucket, random within bucket,
+        # rolled by a random number of batches, not to leave samples of the last bucket for the next chunk every time,
+        # wrap (longest -> shortest samples) falls on a batch boundary, so no batch mixes both ends
+        n_full = n // self._batch_size
+        order = np.lexsort((self.rng.random(n), buckets)).astype(dtype)
+        order = np.roll(order, self.rng.integers(n_full + 1) * self._batch_size)
+
+        # full batches in random order, remaining samples at the end (will be left for the next chunk)
+        full = order[:n_full * self._batch_size].reshape(n_full, self._batch_size)
+        full = full[self.rng.permutation(n_full)]
+        return samples[np.concatenate([full.ravel(), order[n_full * self._batch_size:]])]
+
 
 class FilesBatcher(BaseBatcher):
-    """ FilesBatcher uses thread to load files with TR data in the background """
+    """ FilesBatcher uses threads to load files with TR data in the background """
 
     def __init__(
             self,
             data_files: List[str],
             chunk_builder: callable,
-            logger=         None,
-            loglevel=       20,
+            num_workers: int=               1,
+            prefetch_factor: int=           1,
+            cache_dir: Optional[str]=       None,
+            logger=                         None,
+            loglevel=                       20,
             **kwargs,
     ):
         """
         data_files:
             list of file paths where data of TR chunks is stored
         chunk_builder(file:str):
-            function that should return chunk of data Dict[str,NPL] given file path """
+            function that should return chunk of data Dict[str,NPL] given file path
+        num_workers:
+            number of threads loading chunks in parallel,
+            > 1 helps when chunk_builder is IO bound (or releases GIL)
+        prefetch_factor:
+            number of chunks loaded in advance per worker,
+            num_workers * prefetch_factor chunks are kept in flight (memory) besides the current one,
+            > 1 smooths uneven loading times at the cost of memory
+        cache_dir:
+            directory where chunks built by chunk_builder are saved (.npy / .pt per key),
+            every next load of a file (next epoch, other run) memory-maps saved chunk
+            instead of calling chunk_builder (file modified since then is built again),
+            chunk values have to be np.ndarray or torch.Tensor """
 
         self.logger = logger or get_pylogger(
             name=   f'{self.__class__.__name__}_logger',
             level=  loglevel)
 
-        self._data_files = data_files
-        if not self._data_files:
+        if not data_files:
             raise BatcherException(f'data_files is empty: {data_files}')
+        self._data_files = deque(data_files) # rotated round-robin
 
         self._chunk_builder = chunk_builder
         self.logger.info(f'*** {self.__class__.__name__} *** initializes with {len(self._data_files)} files (TR chunks).')
 
-        self._data_chunks = []
-        self.q_to_loader = queue.Queue()
+        self._cache_dir = cache_dir
+        if self._cache_dir:
+            os.makedirs(self._cache_dir, exist_ok=True)
 
-        self.loader_thread = threading.Thread(target=self._loader_loop)
-        self.loader_thread.start()
-        self.q_to_loader.put('load') # put the first task
+        self._executor = ThreadPoolExecutor(max_workers=num_workers)
+        self._futures = deque() # FIFO of chunks in flight, keeps files order
+        for _ in range(num_workers * prefetch_factor):
+            self._submit_next_file()
 
         super().__init__(logger=self.logger, **kwargs)
-        
-    def _loader_loop(self):
-        
-        self.logger.debug('loader started loop')
-
-        while True:
-
-            stime = time.time()
-            msg = self.q_to_loader.get()
-            self.logger.debug(f'> loader thread waited {time.time() - stime:.2f}sec for a new task (msg)')
 
-            if msg == 'load':
-
-                stime = time.time()
-
-                file = self._data_files.pop(0)
-                self._data_files.append(file)
+    def _submit_next_file(self):
+        file = self._data_files[0]
+        self._data_files.rotate(-1)
+        self._futures.append(self._executor.submit(self._load_file, file))
+
+    def _load_file(self, file:str) -> Dict[str,NPL]:
+        stime = time.time() if self.logger.isEnabledFor(logging.DEBUG) else None
+        self.logger.debug('>> loader starts loading file: %s ..', file)
+        if self._cache_dir:
+            data = self._load_cached(file)
+            if data is None:
+                self._save_cached(file=file, data=self._chunk_builder(file=file))
+                data = self._load_cached(file)
+        else:
+            data = self._chunk_builder(file=file)
+        if stime is not None:
+            self.logger.debug('>> loader loaded chunk of data from file: %s, took %.2fsec', file, time.time() - stime)
+        return data
 
-                self.logger.debug(f'>> loader starts loading file: {file} ..')
-                _data = self._chunk_builder(file=file)
-                self._data_chunks.append(_data)
-                self.logger.debug(f'>> loader added chunk of data from file: {file}, thread took {time.time()-stime:.2f}sec')
+    def _cache_prefix(self, file:str) -> str:
+        """ cache prefix of a file, source mtime and size are a part of the key,
+        so a regenerated file is never served with a stale cache """
+        st = os.stat(file)
+        key = f'{os.path.abspath(file)}|{st.st_mtime_ns}|{st.st_size}'
+        return os.path.join(self._cache_dir, hashlib.md5(key.encode()).hexdigest())
+
+    def _replace_with(self, path:str, write:Callable, mode:str='wb'):
+        """ writes to a unique temp file in cache_dir and atomically replaces path with it,
+        the same file may be built by many workers at once """
+        fd, tmp = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _save_cached(self, file:str, data:Dict[str,NPL]):
+        """ saves chunk, keys file is written last (and atomically), it marks complete cache of a file """
+        prefix = self._cache_prefix(file)
+        for k,v in data.items():
+            if isinstance(v, ARR):
+                self._replace_with(f'{prefix}.{k}.npy', write=lambda f: np.save(f, v))
+            elif isinstance(v, TNS):
+                self._replace_with(f'{prefix}.{k}.pt', write=lambda f: torch.save(v.cpu(), f))
+            else:
+                raise BatcherException(f'cache_dir supports only np.ndarray or torch.Tensor values, got {type(v)} for key: {k}')
+        self._replace_with(f'{prefix}.keys', write=lambda f: f.write('\n'.join(data.keys())), mode='w')
 
-            if msg == 'exit':
-                break
+    def _load_cached(self, file:str) -> Optional[Dict[str,NPL]]:
+        """ returns memory-mapped chunk or None if file is not cached """
+        prefix = self._cache_prefix(file)
+        if not os.path.isfile(f'{prefix}.keys'):
+            return None
+        with open(f'{prefix}.keys') as f:
+            keys = f.read().split('\n')
+        data = {}
+        for k in keys:
+            if os.path.isfile(f'{prefix}.{k}.npy'):
+                data[k] = np.load(f'{prefix}.{k}.npy', mmap_mode='r')
+            else:
+                data[k] = torch.load(f'{prefix}.{k}.pt', mmap=True)
+        return data
 
     def load_data_TR_chunk(self) -> Dict[str,NPL]:
-        stime = time.time()
-        while True:
-            if self._data_chunks:
-                _waited = time.time() - stime
-                data = self._data_chunks.pop(0)
-                self.q_to_loader.put('load') # put next task immediately
-                self.logger.debug(f'> load_data_TR_chunk() waited {_waited:.2f}sec '
-                                  f'for a new data chunk, TOT:{time.time() - stime:.2f}sec')
-                return data
-            time.sleep(0.1)
+        stime = time.time() if self.logger.isEnabledFor(logging.DEBUG) else None
+        data = self._futures.popleft().result() # blocks until the oldest chunk is ready
+        self._submit_next_file() # put next task immediately
+        if stime is not None:
+            self.logger.debug('> load_data_TR_chunk() waited %.2fsec for a new data chunk', time.time() - stime)
+        return data
 
     def exit(self):
-        self.q_to_loader.put('exit')
-        self.loader_thread.join()
+        self.close()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._futures.clear()
+
+
+def _chunk_to_shared(chunk:Dict[str,NPL]) -> Tuple[Dict[str,NPL], List[str]]:
+    """ copies np.ndarray and torch.Tensor values of chunk to shared memory (as torch.Tensor),
+    sending such a chunk to another process pickles only small handles, not the data,
+    returns also keys of values that were np.ndarray """
+    shared = {}
+    arr_keys = []
+    for k,v in chunk.items():
+        if isinstance(v, ARR):
+            try:
+                v_tns = torch.from_numpy(np.ascontiguousarray(v)) # (negative) strided arrays are not supported by torch
+            except TypeError: # dtype not supported by torch, will be pickled
+                shared[k] = v
+                continue
+            shared[k] = torch.empty(v_tns.shape, dtype=v_tns.dtype).share_memory_().copy_(v_tns)
+            arr_keys.append(k)
+        elif isinstance(v, TNS):
+            shared[k] = v.share_memory_()
+        else:
+            shared[k] = v
+    return shared, arr_keys
+
+
+def _chunk_from_shared(shared:Dict[str,NPL], arr_keys:List[str]) -> Dict[str,NPL]:
+    """ reverts _chunk_to_shared(), np.ndarray values are zero-copy views of shared memory """
+    for k in arr_keys:
+        shared[k] = shared[k].numpy()
+    return shared
 
 
 class FilesBatcherMP(BaseBatcher):
@@ -341,9 +813,10 @@ class FilesBatcherMP(BaseBatcher):
             self,
             data_files: List[str],
             chunk_builder: callable,
-            n_workers: int= 5,
-            logger=         None,
-            loglevel=       20,
+            n_workers: int=         5,
+            shared_memory: bool=    True,
+            logger=                 None,
+            loglevel=               20,
             **kwargs,
     ):
         """
@@ -354,22 +827,28 @@ class FilesBatcherMP(BaseBatcher):
         n_workers:
             max number of parallel MP workers that will be put into the chunk loading task,
             when average time needed by a worker to load single chunk is greater
-            than time of running this chunk with a NN, number of workers > 1 """
+            than time of running this chunk with a NN, number of workers > 1
+        shared_memory:
+            chunks are sent from workers through shared memory,
+            without it chunk data is pickled and copied (slow for big chunks) """
 
         self.logger = logger or get_pylogger(
             name=   f'{self.__class__.__name__}_logger',
             level=  loglevel)
 
-        self._data_files = data_files
-        if not self._data_files:
+        if not data_files:
             raise BatcherException(f'data_files is empty: {data_files}')
+        self._data_files = deque(data_files) # rotated round-robin
 
         self._chunk_builder = chunk_builder
         self.logger.info(f'*** {self.__class__.__name__} *** initializes with {len(self._data_files)} files (TR chunks).')
 
+        self._shared_memory = shared_memory
+
         class ChunkBuilder(RunningWorker):
             def process(self, **kwargs) -> Any:
-                return chunk_builder(**kwargs)
+                chunk = chunk_builder(**kwargs)
+                return _chunk_to_shared(chunk) if shared_memory else chunk
 
         logger_child = get_child(logger=self.logger, name=f'{self.logger.name}_child', change_level=10)
         self.ompr = OMPRunner(
@@ -385,16 +864,100 @@ class FilesBatcherMP(BaseBatcher):
         super().__init__(logger=self.logger, **kwargs)
 
     def _put_next_task_to_ompr(self):
-        file = self._data_files.pop(0)
-        self._data_files.append(file)
+        file = self._data_files[0]
+        self._data_files.rotate(-1)
         self.ompr.process({'file':file})
 
     def load_data_TR_chunk(self) -> Dict[str,NPL]:
-        stime = time.time()
+        stime = time.time() if self.logger.isEnabledFor(logging.DEBUG) else None
         data = self.ompr.get_result()
-        self.logger.debug(f'> load_data_TR_chunk() waited {time.time() - stime:.2f}sec for a new data chunk')
+        if self._shared_memory:
+            data = _chunk_from_shared(*data)
+        if stime is not None:
+            self.logger.debug('> load_data_TR_chunk() waited %.2fsec for a new data chunk', time.time() - stime)
         self._put_next_task_to_ompr() # put next task immediately
         return data
 
     def exit(self):
-        self.ompr.exit()
\ No newline at end of file
+        self.close()
+        self.ompr.exit()
+
+
+class CUDAPrefetchBatcher:
+    """ CUDAPrefetchBatcher wraps a Batcher and prefetches its TR batches to a CUDA device.
+    Next batch is copied (non_blocking, from pinned memory) on a side CUDA stream
+    while the current one is used, so host->device transfer overlaps with computation.
+    Returned batch values (np.ndarray converted to torch.Tensor) are placed on the device,
+    tensors are recorded with the current stream, if a batch is used on another stream
+    it should be recorded there (Tensor.record_stream) by the user.
+    With pin_memory batches are pinned by the prefetch thread of the wrapped batcher (started here if not yet),
+    pinning is not on the critical path of get_batch(). """
+
+    def __init__(
+            self,
+            batcher: BaseBatcher,
+            device=             'cuda',
+            pin_memory: bool=   True,   # batch memory is pinned before copy, without it copy is not async
+    ):
+
+        if not torch.cuda.is_available():
+            raise BatcherException('CUDAPrefetchBatcher requires CUDA')
+
+        self.batcher = batcher
+        self.device = torch.device(device)
+        self.pin_memory = pin_memory
+
+        # batches are pinned in the background,
+        # batcher with already started prefetch (without pin_memory) gets its batches pinned in _to_device()
+        if self.pin_memory and self.batcher._prefetch_thread is None:
+            self.batcher.start_prefetch(pin_memory=True)
+
+        self._stream = torch.cuda.Stream(device=self.device)
+        self._next = None
+        self._preload()
+
+    def _to_device(self, v:Any) -> Any:
+        if isinstance(v, ARR):
+            v = torch.from_numpy(v)
+        if isinstance(v, TNS):
+            if self.pin_memory and v.device.type == 'cpu' and not v.is_pinned():
+                v = v.pin_memory()
+            v = v.to(self.device, non_blocking=True)
+        return v
+
+    def _preload(self):
+        batch = self.batcher.get_batch()
+        with torch.cuda.stream(self._stream):
+            self._next = {k: self._to_device(batch[k]) for k in batch}
+
+    def get_batch(self) -> Dict[str,NPL]:
+
+        current_stream = torch.cuda.current_stream(self.device)
+        current_stream.wait_stream(self._stream)
+
+        batch = self._next
+        for v in batch.values():
+            if isinstance(v, TNS):
+                v.record_stream(current_stream)
+
+        self._preload()
+        return batch
+
+    def get_TS_batches(self, name:Optional[str]=None) -> List[Dict[str,NPL]]:
+        return self.batcher.get_TS_batches(name)
+
+    def get_data_size(self) -> Tuple[int,int]:
+        return self.batcher.get_data_size()
+
+    def exit(self):
+        """ stops prefetch of the wrapped batcher and exits it (e.g. FilesBatcher executor) """
+        self.batcher.close()
+        if hasattr(self.batcher, 'exit'):
+            self.batcher.exit()
+
+    def get_TS_names(self) -> Optional[List[str]]:
+        return self.batcher.get_TS_names()
+
+    @property
+    def keys(self) -> List[str]:
+        return self.batcher.keys
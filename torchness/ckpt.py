@@ -1,4 +1,5 @@
 from collections import OrderedDict
+import os
 import torch
 from typing import Optional
 
@@ -10,10 +11,11 @@ def ckpt_nfo(
         ckptA: str,                     # checkpoint A (file name)
         ckptB: Optional[str]=   None,   # checkpoint B (file name)
 ):
-    """ returns checkpoint info, if given two - checks if B is equal A """
+    """ returns checkpoint info, if given two - checks if B is equal A
+    checkpoints are memory-mapped, tensor data is read only when compared """
 
-    checkpoint_A = torch.load(ckptA, map_location='cpu')
-    checkpoint_B = torch.load(ckptB, map_location='cpu') if ckptB else None
+    checkpoint_A = torch.load(ckptA, map_location='cpu', mmap=True)
+    checkpoint_B = torch.load(ckptB, map_location='cpu', mmap=True) if ckptB else None
     are_equal = True
 
     cmsd_A = checkpoint_A['model_state_dict']
@@ -25,7 +27,9 @@ def ckpt_nfo(
         print(f'{k:100} shape: {str(list(tns.shape)):15} {tns.dtype}')
         if cmsd_B:
             if k in cmsd_B:
-                if not torch.equal(cmsd_A[k], cmsd_B[k]):
+                tns_B = cmsd_B[k]
+                # metadata check first, compares data only when needed
+                if tns.shape != tns_B.shape or tns.dtype != tns_B.dtype or not torch.equal(tns, tns_B):
                     print(f' ---> is not equal in second checkpoint')
                     are_equal = False
             else:
@@ -44,38 +48,43 @@ def mrg_ckpts(
 ):
     """ weighted merge of two checkpoints (on CPU)
     does NOT check for compatibility of two checkpoints, but will crash if those are not compatible
-    forced to perform on CPU device (not to raise any CUDA errors) """
+    forced to perform on CPU device (not to raise any CUDA errors)
+    checkpoint B is memory-mapped (only read), A is fully loaded since its tensors are saved to M,
+    B is fully loaded too when M is saved over B (file cannot be mapped while truncated) """
     with torch.no_grad():
 
         checkpointA = torch.load(ckptA, map_location='cpu')
-        checkpointB = torch.load(ckptB, map_location='cpu') if ckptB else checkpointA
+        if ckptB:
+            mmap_B = os.path.realpath(ckptB) != os.path.realpath(ckptM)
+            checkpointB = torch.load(ckptB, map_location='cpu', mmap=mmap_B)
+        else:
+            checkpointB = checkpointA
 
         cmsdA = checkpointA['model_state_dict']
         cmsdB = checkpointB['model_state_dict']
         cmsdM = OrderedDict()
 
+        # ratio & noise may be given as (CUDA) tensors
+        ratio = float(ratio)
+        noise = float(noise)
+
         for k in cmsdA:
             tnsA = cmsdA[k]
             if tnsA.is_floating_point():
 
-                if type(ratio) is torch.Tensor:
-                    ratio = ratio.cpu()
-
-                tnsB = cmsdB[k]
-                cmsdM[k] = ratio * tnsA + (1 - ratio) * tnsB
+                # single fused kernel, result is written once
+                tnsM = torch.lerp(cmsdB[k], tnsA, ratio)
 
                 if noise > 0.0:
 
-                    std_dev = torch.std(tnsA)
+                    std_dev = float(torch.std(tnsA))
                     if std_dev != 0.0:
 
-                        noise_tensor = torch.zeros_like(tnsA)
+                        noise_tensor = torch.empty_like(tnsA)
                         my_initializer(noise_tensor, std=std_dev)
+                        tnsM.add_(noise_tensor, alpha=noise)
 
-                        if type(noise) is torch.Tensor:
-                            noise = ratio.cpu()
-
-                        cmsdM[k] += noise * noise_tensor
+                cmsdM[k] = tnsM
             else:
                 cmsdM[k] = tnsA
 
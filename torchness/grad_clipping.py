@@ -1,7 +1,7 @@
 from pypaq.lipytools.moving_average import MovAvg
 from pypaq.lipytools.pylogger import get_pylogger
 import torch
-from typing import Optional, Union, Iterator, Dict
+from typing import Optional, Union, Iterator, Dict, List
 
 from torchness.base import TNS, NUM, NPL, TorchnessException
 
@@ -23,24 +23,36 @@ def clip_grad_norm_(
     if len(parameters_grad) == 0:
         return 0.0
 
-    device = parameters_grad[0].grad.device  # choose single device for computation
-    if norm_type == torch.inf:
-        norms = [p.grad.detach().abs().max().to(device) for p in parameters_grad]
-        total_norm = norms[0] if len(norms) == 1 else torch.max(torch.stack(norms))
+    grads = [p.grad for p in parameters_grad]
+
+    # grads grouped by device, foreach ops run per device
+    grads_dev: Dict[torch.device,List[TNS]] = {}
+    for g in grads:
+        grads_dev.setdefault(g.device, []).append(g)
+    single_device = len(grads_dev) == 1 # common case, no moves between devices needed
+
+    if len(grads) == 1:
+        total_norm = torch.linalg.vector_norm(grads[0], norm_type)
     else:
-        total_norm = torch.norm(
-            torch.stack([
-                torch.norm(p.grad.detach(), norm_type).to(device)
-                for p in parameters_grad]),
-            norm_type)
+        # single (multi-tensor) kernel per device instead of one per parameter
+        if single_device:
+            norms = torch._foreach_norm(grads, norm_type)
+        else:
+            device = grads[0].device  # choose single device for computation
+            norms = []
+            for dev_grads in grads_dev.values():
+                norms += [n.to(device) for n in torch._foreach_norm(dev_grads, norm_type)]
+        total_norm = torch.linalg.vector_norm(torch.stack(norms), norm_type)
 
     if do_clip:
         if max_norm is None:
             raise TorchnessException('max_norm must be given when clipping')
-        clip_coef = max_norm / (total_norm + 1e-6)
-        clip_coef_clamped = torch.clamp(clip_coef, max=1.0)
-        for p in parameters_grad:
-            p.grad.detach().mul_(clip_coef_clamped.to(p.grad.device))
+        clip_coef = (max_norm / (total_norm + 1e-6)).clamp_(max=1.0)
+        if single_device:
+            torch._foreach_mul_(grads, clip_coef)
+        else:
+            for dev, dev_grads in grads_dev.items():
+                torch._foreach_mul_(dev_grads, clip_coef.to(dev))
 
     return total_norm.item()
 
@@ -65,6 +77,7 @@ class GradClipperMAVG:
         self.logger = logger
 
         self.module = module
+        self._params: Optional[List[TNS]] = None # parameters of module, cached with first clip()
 
         self.mavg = MovAvg(factor=factor, first_avg=first_avg)
         self.mavg.upd(start_val)
@@ -73,17 +86,26 @@ class GradClipperMAVG:
         self.max_upd = max_upd
         self.do_clip = do_clip
 
+    def invalidate_params(self):
+        """ parameters of module will be collected again with next clip(),
+        should be called after parameters of module have been added / replaced """
+        self._params = None
+
     # clip & update parameters
     def clip(self) -> Dict[str,float]:
 
+        if self._params is None:
+            params = self.module.parameters()
+            self._params = [params] if isinstance(params, torch.Tensor) else list(params)
+
         gg_norm_clip = self.mavg()
-        self.logger.debug(f'gg_norm_clip: {gg_norm_clip}')
+        self.logger.debug('gg_norm_clip: %s', gg_norm_clip)
 
         gg_norm = clip_grad_norm_(
-            parameters= self.module.parameters(),
+            parameters= self._params,
             max_norm=   gg_norm_clip,
             do_clip=    self.do_clip)
-        self.logger.debug(f'gg_norm: {gg_norm}')
+        self.logger.debug('gg_norm: %s', gg_norm)
 
         mavg_update = min(gg_norm, gg_norm_clip*self.max_upd)
         if self.max_clip and mavg_update > self.max_clip:
@@ -1,12 +1,14 @@
 import torch
 
-from torchness.base import NUM
+from torchness.base import NUM, TNS
 
 
 # weights initializer from BERT
-# the only difference is that in torch values are CLAMPED not SAMPLED till in <a,b>
-def bert_initializer(*args, std:NUM=0.02, **kwargs):
-    return torch.nn.init.trunc_normal_(*args, **kwargs, std=std, a=-2*std, b=2*std)
+# the only difference is that here values are CLAMPED not SAMPLED till in <a,b>
+# normal_ + clamp_ are two in-place passes over the tensor, run on its device
+def bert_initializer(tensor:TNS, std:NUM=0.02, mean:NUM=0.0, generator=None) -> TNS:
+    with torch.no_grad():
+        return tensor.normal_(mean=mean, std=std, generator=generator).clamp_(min=-2*std, max=2*std)
 
 
 def my_initializer(*args, std:NUM=0.02, **kwargs):
@@ -16,4 +18,5 @@ def my_initializer(*args, std:NUM=0.02, **kwargs):
     # - kaiming_uniform_ is uniform_ with bound from 2015 paper, (for relu)
     # - xavier_uniform_ is uniform_ whit bound from 2010 paper (for linear / sigmoid)
     # - trunc_normal_ is normal with mean 0 and given std, all values SAMPLED till in <a,b>
+    # here bert_initializer is used: normal_ CLAMPED to <a,b>, both run on tensor device (no host sync)
     return bert_initializer(*args, **kwargs, std=std)
@@ -1,3 +1,4 @@
+from contextlib import nullcontext
 import math
 import torch
 from typing import Optional
@@ -24,6 +25,8 @@ class LayDense(torch.nn.Linear):
             bias=           bias,
             **kwargs)
         self.activation = activation() if activation else None
+        # ReLU is applied in-place on linear output, no second output allocation
+        self._relu_ = isinstance(self.activation, torch.nn.ReLU)
 
     def reset_parameters(self) -> None:
 
@@ -38,7 +41,8 @@ class LayDense(torch.nn.Linear):
 
     def forward(self, inp:TNS) -> TNS:
         out = super().forward(inp)
-        if self.activation: out = self.activation(out)
+        if self._relu_: out = out.relu_()
+        elif self.activation: out = self.activation(out)
         return out
 
     def extra_repr(self) -> str:
@@ -59,29 +63,28 @@ class TF_Dropout(torch.nn.Dropout):
         self.feat_drop = feat_drop
         super(TF_Dropout, self).__init__(inplace=inplace)
 
+    def _mask(self, n:int, p:float, inp:TNS) -> Optional[TNS]:
+        """ returns dropout mask (scaled by 1/keep) of size n, drawn directly on inp device,
+        None when not training """
+        if not self.training or not p:
+            return None
+        keep = 1 - p
+        mask = torch.empty(n, device=inp.device, dtype=inp.dtype).bernoulli_(keep)
+        if keep > 0:
+            mask.div_(keep)
+        return mask
+
     def forward(self, inp:TNS) -> TNS:
 
         output = inp
         in_shape = inp.size()
 
-        if self.time_drop:
-            t_drop = torch.ones(in_shape[-2])
-            t_drop = torch.nn.functional.dropout(
-                input=      t_drop,
-                p=          self.time_drop,
-                training=   self.training,
-                inplace=    self.inplace)
-            t_drop = torch.unsqueeze(t_drop, dim=-1)
-            output = output * t_drop
-
-        if self.feat_drop:
-            f_drop = torch.ones(in_shape[-1])
-            f_drop = torch.nn.functional.dropout(
-                input=      f_drop,
-                p=          self.feat_drop,
-                training=   self.training,
-                inplace=    self.inplace)
-            f_drop = torch.unsqueeze(f_drop, dim=-2)
+        t_drop = self._mask(in_shape[-2], self.time_drop, inp)
+        if t_drop is not None:
+            output = output * torch.unsqueeze(t_drop, dim=-1)
+
+        f_drop = self._mask(in_shape[-1], self.feat_drop, inp)
+        if f_drop is not None:
             output = output * f_drop
 
         return output
@@ -122,6 +125,14 @@ class LayConv1D(torch.nn.Conv1d):
 
         self.activation = activation() if activation else None
 
+        # pointwise conv (kernel_size 1, no stride / padding / groups) is a linear over channels @ -1 dim,
+        # it is computed directly on (N,L,C) without transposes
+        self._pointwise = (
+            self.kernel_size == (1,)
+            and self.stride == (1,)
+            and self.groups == 1
+            and self.padding in ('same', 'valid', (0,)))
+
         if not initializer: initializer = my_initializer
         initializer(self.weight)
         if self.bias is not None:
@@ -132,9 +143,12 @@ class LayConv1D(torch.nn.Conv1d):
             torch.nn.init.zeros_(self.bias)
 
     def forward(self, inp:TNS) -> TNS:
-        inp_trans = torch.transpose(input=inp, dim0=-1, dim1=-2) # transposes inp to (N,C,L) <- (N,L,C), since torch.nn.Conv1d assumes that channels is @ -2 dim
-        out = super().forward(input=inp_trans)
-        out = torch.transpose(out, dim0=-1, dim1=-2) # transpose back
+        if self._pointwise:
+            out = torch.nn.functional.linear(inp, self.weight.squeeze(-1), self.bias)
+        else:
+            inp_trans = torch.transpose(input=inp, dim0=-1, dim1=-2) # transposes inp to (N,C,L) <- (N,L,C), since torch.nn.Conv1d assumes that channels is @ -2 dim
+            out = super().forward(input=inp_trans)
+            out = torch.transpose(out, dim0=-1, dim1=-2) # transpose back
         if self.activation: out = self.activation(out)
         return out
 
@@ -165,22 +179,27 @@ class PositionalEncoding(torch.nn.Module):
     def __init__(
             self,
             d_model: int,
-            dropout: float= 0.0,
-            max_len: int=   512):
+            dropout: float=     0.0,
+            max_len: int=       512,
+            dtype: torch.dtype= torch.float32): # dtype of pe buffer, should match dtype of x (e.g. bf16), to not promote x with add
 
         super().__init__()
 
         self.dropout = torch.nn.Dropout(p=dropout) if dropout else None
+        self.max_len = max_len
 
         position = torch.arange(max_len).unsqueeze(1)
         div_term = torch.exp(torch.arange(0, d_model, 2) * (-math.log(10000.0) / d_model))
-        pe = torch.zeros(max_len, d_model)
-        pe[:, 0::2] = torch.sin(position * div_term)
-        pe[:, 1::2] = torch.cos(position * div_term)
-        self.register_buffer('pe', pe)
+        angle = position * div_term # computed once for sin & cos
+        pe = torch.empty(max_len, d_model) # every value is set below
+        pe[:, 0::2] = torch.sin(angle)
+        pe[:, 1::2] = torch.cos(angle[:, :d_model//2])
+        self.register_buffer('pe', pe.to(dtype)) # pe is computed in fp32
 
     # x - tensor of shape [..,seq,feats]
     def forward(self, x:TNS) -> TNS:
+        if x.size(-2) > self.max_len:
+            raise TorchnessException(f'sequence length {x.size(-2)} exceeds max_len {self.max_len} of PositionalEncoding')
         x = x + self.pe[:x.size(-2)]
         if self.dropout:
             x = self.dropout(x)
@@ -188,20 +207,15 @@ class PositionalEncoding(torch.nn.Module):
 
 
 def zeroes(inp:TNS, no_grad=True) -> TNS:
-    """ returns [0,1] Tensor: 1 where inp not activated (value =< 0)
+    """ returns [0,1] (int8) Tensor: 1 where inp not activated (value =< 0)
     looks at last dimension / features """
 
-    was_grad_enabled = False
-    if no_grad and torch.is_grad_enabled():
-        torch.set_grad_enabled(False)
-        was_grad_enabled = True
-
-    activated = (inp > 0).to(int)
-    axes = list(range(len(inp.shape)))[:-1]  # all but last(feats) axes indexes list like: [0,1,2] for 4d shape
-    activated_reduced = torch.sum(activated, dim=axes) if axes else activated  # 1 or more for activated, 0 for not activated, if not axes -> we have only-feats-tensor-case
-    zs = (activated_reduced == 0).to(int)
+    with torch.no_grad() if no_grad else nullcontext():
 
-    if was_grad_enabled:
-        torch.set_grad_enabled(True)
+        # only-feats-tensor-case
+        if inp.ndim == 1:
+            return (inp <= 0).to(torch.int8)
 
-    return zs
\ No newline at end of file
+        # single bool reduction over all but last(feats) axes, True for activated
+        activated = torch.any(inp > 0, dim=tuple(range(inp.ndim-1)))
+        return (~activated).to(torch.int8)
\ No newline at end of file
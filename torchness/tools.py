@@ -15,18 +15,15 @@ def min_max_probs(probs:TNS) -> DTNS:
 def select_with_indices(source:TNS, indices:TNS) -> TNS:
     """ selects from the (multidimensional dim) source
     values from the last axis
-    given with indices (dim-1) tensor of ints """
-    indices = torch.unsqueeze(indices, dim=-1)
-    source_selected = torch.gather(source, dim=-1, index=indices)
-    return torch.squeeze(source_selected, dim=-1)
+    given with indices (dim-1) tensor of ints,
+    indices leading dims are broadcast against source """
+    return torch.take_along_dim(source, indices.unsqueeze(-1), dim=-1).squeeze(-1)
 
 
 def normalize_logits(logits:TNS) -> TNS:
-    """ normalizes N-dim log-prob tensor """
-    probs = torch.nn.functional.softmax(logits, dim=-1)
-    return torch.log(probs)
-    # or this way:
-    # return logits - logits.logsumexp(dim=-1, keepdim=True)
+    """ normalizes N-dim log-prob tensor
+    single log_softmax pass, no intermediate probs tensor """
+    return torch.nn.functional.log_softmax(logits, dim=-1)
 
 
 def count_model_params(model:torch.nn.Module) -> int:
@@ -53,7 +50,7 @@ def perplexity(logits:TNS, target:TNS) -> TNS:
     N-dim log-prob
     N-1-dim target of indexes (int) """
     logits_norm = normalize_logits(logits)
-    action_target_logits_mean = logits_norm[range(len(logits)), target].mean()
+    action_target_logits_mean = select_with_indices(logits_norm, target).mean()
     ppx = torch.exp(-action_target_logits_mean)
     # or this way:
     # ce_loss = cross_entropy_loss(logits, action_target)
@@ -70,8 +67,8 @@ def brier_score(probs:TNS, action_sampled:TNS, action_target:TNS):
     probs - N-dim 
     action sampled - N-1-dim of indexes (int) 
     action target - N-1-dim of indexes (int) """
-    y = (action_sampled == action_target).to(torch.float)
-    return torch.pow(probs[range(len(action_target)), action_target] - y, 2).mean()
+    y = (action_sampled == action_target).to(probs.dtype)
+    return torch.square(select_with_indices(probs, action_target) - y).mean()
 
 
 def mean_square_error(pred:TNS, target:TNS):
@@ -86,4 +83,5 @@ def diff_avg_max(pred:TNS, target:TNS) -> Tuple[TNS,TNS,TNS]:
     probs diff max avg
     probs diff max """
     diff = torch.abs(pred - target)
-    return diff.mean(), diff.max(dim=-1)[0].mean(), diff.max()
+    diff_max = diff.max(dim=-1)[0] # global max is taken from reduced rows
+    return diff.mean(), diff_max.mean(), diff_max.max()
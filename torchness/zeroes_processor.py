@@ -15,8 +15,12 @@ class ZeroesProcessor:
             tag_pfx=            'nane',     # prefix of tag in TB, (Not Activated NEurons)
             tbwr: Optional=     None):      # if given will put summaries to TB with intervals frequencies
         self.intervals = intervals
-        self.zsDL: Dict[int,List[TNS]] = {k: [] for k in self.intervals}
-        self.single: List[TNS] = []
+        # running sums of zeroes (and number of summed) per interval
+        self.zsD_sum: Dict[int,Optional[TNS]] = {k: None for k in self.intervals}
+        self.zsD_cnt: Dict[int,int] = {k: 0 for k in self.intervals}
+        # running sum of single zeroes means (and number of summed)
+        self.single_sum: Optional[TNS] = None
+        self.single_cnt = 0
         self.tag_pfx = tag_pfx
         self.tbwr = tbwr
         self.step = 0
@@ -52,20 +56,26 @@ class ZeroesProcessor:
                     return iv_nane
                 zeroes = torch.cat(zeroes)
 
-            self.single.append(torch.mean(zeroes, dtype=torch.float32))
-
-            if len(self.single) == self.intervals[0]:
-                iv_nane[1] = torch.Tensor(self.single).mean()
-                self.single = []
-
-            for k in self.zsDL:
-                self.zsDL[k].append(zeroes)
-                if len(self.zsDL[k]) == k:
-                    stacked = torch.stack(self.zsDL[k], dim=0)
-                    mean = torch.mean(stacked, dim=0, dtype=torch.float32)  # mean along 0 axis (averages non activated over k)
-                    clipped = (mean==1).to(torch.float32)                   # where average over k is 1 leave 1, else 0
+            single = torch.mean(zeroes, dtype=torch.float32)
+            self.single_sum = single if self.single_sum is None else self.single_sum + single
+            self.single_cnt += 1
+
+            if self.single_cnt == self.intervals[0]:
+                iv_nane[1] = self.single_sum / self.single_cnt # stays on zeroes device
+                self.single_sum = None
+                self.single_cnt = 0
+
+            for k in self.intervals:
+                if self.zsD_sum[k] is None:
+                    self.zsD_sum[k] = zeroes.to(torch.float32, copy=True)
+                else:
+                    self.zsD_sum[k].add_(zeroes)
+                self.zsD_cnt[k] += 1
+                if self.zsD_cnt[k] == k:
+                    clipped = (self.zsD_sum[k]==k).to(torch.float32)        # where sum (average) over k is k (1) leave 1, else 0
                     iv_nane[k] = clipped.mean()                             # factor of neurons not activated (1) over k
-                    self.zsDL[k] = []                                       # reset
+                    self.zsD_sum[k] = None                                  # reset
+                    self.zsD_cnt[k] = 0
 
         if self.tbwr:
             for k in iv_nane: